@@ -0,0 +1,133 @@
+"""Command line entry point to check many Home Assistant config dirs."""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import sys
+from pyupdate.ha_custom import common
+from pyupdate.ha_custom.manager import Manager
+
+TYPES = ('components', 'cards', 'python_scripts')
+
+
+def get_parser():
+    """Return the argument parser."""
+    parser = argparse.ArgumentParser(
+        prog='pyupdate',
+        description='Check Home Assistant config dirs for updates, '
+                    'printing one JSON line per config dir.')
+    parser.add_argument(
+        'base_dirs', nargs='+', metavar='base_dir',
+        help='Home Assistant config dir')
+    parser.add_argument(
+        '-j', '--concurrency', type=int, default=8,
+        help='number of config dirs checked in parallel (default: 8)')
+    parser.add_argument(
+        '--timeout', type=float, default=300,
+        help='seconds allowed per config dir (default: 300)')
+    parser.add_argument(
+        '--types', type=parse_types, default=TYPES,
+        help='comma separated types to check, any of {} '
+             '(default: all)'.format(', '.join(TYPES)))
+    parser.add_argument(
+        '--mode', choices=('yaml', 'storage'), default='storage',
+        help='lovelace mode used to find cards (default: storage)')
+    parser.add_argument(
+        '--component-repo', action='append', default=[],
+        help='extra repos.json for components, may be repeated')
+    parser.add_argument(
+        '--card-repo', action='append', default=[],
+        help='extra repos.json for cards, may be repeated')
+    parser.add_argument(
+        '--python-script-repo', action='append', default=[],
+        help='extra repos.json for python_scripts, may be repeated')
+    parser.add_argument(
+        '--token', help='GitHub token used to raise the rate limit')
+    return parser
+
+
+def parse_types(value):
+    """Return the types in a comma separated list, rejecting unknown ones."""
+    types = tuple(name.strip() for name in value.split(',') if name.strip())
+    if not types:
+        raise argparse.ArgumentTypeError('no type given')
+    unknown = [name for name in types if name not in TYPES]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            'unknown type {!r}, choose from {}'.format(
+                ','.join(unknown), ', '.join(TYPES)))
+    return types
+
+
+async def check(manager, base_dir, args):
+    """Return sensor data for all requested types in base_dir."""
+    types = args.types
+    result = {'base_dir': base_dir, 'updates': 0}
+    views = []
+    try:
+        if 'components' in types:
+            views.append(('components', manager.components(
+                base_dir, args.component_repo)))
+        if 'cards' in types:
+            views.append(('cards', manager.cards(
+                base_dir, args.mode, [], args.card_repo)))
+        if 'python_scripts' in types:
+            views.append(('python_scripts', manager.python_scripts(
+                base_dir, args.python_script_repo)))
+        for name, view in views:
+            data, count = await view.get_sensor_data()
+            result[name] = data
+            result['updates'] += count
+    finally:
+        for _, view in views:
+            manager.release(view)
+    return result
+
+
+def run(manager, base_dir, args):
+    """Check a single config dir in its own event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(asyncio.wait_for(
+            check(manager, base_dir, args), args.timeout))
+    except asyncio.TimeoutError:
+        return {'base_dir': base_dir, 'error': 'timeout'}
+    except Exception as error:  # pylint: disable=W0703
+        return {'base_dir': base_dir, 'error': str(error)}
+    finally:
+        loop.close()
+
+
+def main(argv=None):
+    """Run the command line interface."""
+    args = get_parser().parse_args(argv)
+    if args.token:
+        common.set_github_token(args.token)
+    concurrency = max(1, args.concurrency)
+    manager = Manager()
+    failed = False
+    base_dirs = iter(args.base_dirs)
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        # Keep only a bounded number of config dirs in flight, so memory
+        # stays flat no matter how many are given.
+        pending = set()
+        for base_dir in base_dirs:
+            pending.add(pool.submit(run, manager, base_dir, args))
+            if len(pending) >= concurrency * 2:
+                break
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                failed = failed or 'error' in result
+                sys.stdout.write(json.dumps(result, default=list) + '\n')
+                sys.stdout.flush()
+                base_dir = next(base_dirs, None)
+                if base_dir is not None:
+                    pending.add(pool.submit(run, manager, base_dir, args))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
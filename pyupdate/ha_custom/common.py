@@ -1,23 +1,223 @@
 """Logic to handle common functions."""
+import asyncio
+import functools
+import json
 import os
-import fileinput
+import random
+import re
+import shutil
 import subprocess
 import sys
-import requests
+import threading
+import time
+from urllib.parse import urlparse
+from pyupdate.ha_custom import ratelimit
 from pyupdate.log import Logger
 
 LOGGER = Logger('Common')
 
+TIMEOUT = (5, 15)
+HOST_TIMEOUTS = {}
+RETRIES = 3
+BACKOFF = 0.5
+BACKOFF_MAX = 8
+FAILURE_THRESHOLD = 3
+COOLDOWN = 300
+BREAKERS = {}
+LIMITS = {}
+# Guards BREAKERS, LIMITS and breaker state, shared by all threads.
+HOSTS_LOCK = threading.Lock()
+GIT_BASE = 'https://raw.githubusercontent.com/'
+GITHUB_HOSTS = ('raw.githubusercontent.com', 'api.github.com', 'github.com')
+GITHUB_TOKEN = None
+SESSION = None
+STORAGE_VERSION = 2
+VERSION_RE = re.compile(r"^\b(VERSION|__version__)\s*=\s*['\"](.*)['\"]")
+REQUIREMENTS_RE = re.compile(r"^\bREQUIREMENTS\s*=\s*(.*)")
+
+
+class CircuitBreaker():
+    """Track failures for a remote host and short-circuit dead hosts."""
+
+    def __init__(self, host, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        """Init."""
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+
+    @property
+    def state(self):
+        """Return closed, open or half_open."""
+        if self.opened is None:
+            return 'closed'
+        if time.monotonic() - self.opened >= self.cooldown:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Return True if a request to the host should be attempted."""
+        return self.state != 'open'
+
+    def success(self):
+        """Register a successful request."""
+        with HOSTS_LOCK:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        """Register a failed request."""
+        with HOSTS_LOCK:
+            self.failures += 1
+            if self.failures >= self.threshold or self.state == 'half_open':
+                self.opened = time.monotonic()
+
+    def as_dict(self):
+        """Return the breaker state."""
+        retry_in = 0
+        if self.state == 'open':
+            retry_in = self.cooldown - (time.monotonic() - self.opened)
+        return {'host': self.host,
+                'state': self.state,
+                'failures': self.failures,
+                'retry_in': round(retry_in, 1)}
+
+
+def get_host(url):
+    """Return the host part of a url."""
+    return urlparse(url).netloc
+
+
+def get_breaker(url):
+    """Return the circuit breaker for the host of a url."""
+    host = get_host(url)
+    with HOSTS_LOCK:
+        if host not in BREAKERS:
+            BREAKERS[host] = CircuitBreaker(host)
+        return BREAKERS[host]
+
+
+def get_limit(url):
+    """Return the rate limit budget for the host of a url."""
+    host = get_host(url)
+    with HOSTS_LOCK:
+        if host not in LIMITS:
+            LIMITS[host] = ratelimit.RateLimit(host)
+        return LIMITS[host]
+
+
+def set_github_token(token):
+    """Set a token used to raise the GitHub rate limit."""
+    global GITHUB_TOKEN  # pylint: disable=W0603
+    GITHUB_TOKEN = token
+
+
+def get_headers(url):
+    """Return request headers for a url.
+
+    Accept-Encoding is left to requests, which offers every encoding the
+    installed urllib3 can decode (br and zstd when available).
+    """
+    headers = {}
+    if GITHUB_TOKEN is not None and get_host(url) in GITHUB_HOSTS:
+        headers['Authorization'] = 'token {}'.format(GITHUB_TOKEN)
+    return headers
+
+
+def get_session():
+    """Return the shared HTTP session, creating it on first use."""
+    global SESSION  # pylint: disable=W0603
+    if SESSION is None:
+        import requests
+        SESSION = requests.Session()
+    return SESSION
+
+
+def set_host_timeout(host, connect, read):
+    """Set connect and read timeout for a host."""
+    HOST_TIMEOUTS[host] = (connect, read)
+
+
+async def breaker_state():
+    """Return the circuit breaker state for all known hosts."""
+    with HOSTS_LOCK:
+        breakers = list(BREAKERS.items())
+    return {host: breaker.as_dict() for host, breaker in breakers}
+
+
+async def rate_limit_state():
+    """Return the rate limit budget for all known hosts."""
+    with HOSTS_LOCK:
+        limits = list(LIMITS.items())
+    return {host: limit.as_dict() for host, limit in limits}
+
+
+async def get_remote(
+        url, retries=RETRIES, priority=ratelimit.PRIORITY_DEFAULT,
+        session=None, method='get', headers=None):
+    """GET a remote file with timeout, retry and circuit breaker.
+
+    method may be set to 'head', the only other idempotent method used.
+    headers are sent in addition to the default ones.
+
+    Requests are spaced out over the rate limit budget of the host, and
+    deferred if the budget is too low for their priority. The blocking
+    request itself runs in the default executor, so the event loop keeps
+    running while a slow host is waited on.
+    Returns the response, or None if the host could not be reached.
+    """
+    import requests
+    loop = asyncio.get_event_loop()
+    if session is None:
+        session = get_session()
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        await LOGGER.debug(
+            'get_remote', 'Circuit open for {}, skipping {}'.format(
+                breaker.host, url))
+        return None
+    limit = get_limit(url)
+    if not limit.allow(priority):
+        await LOGGER.debug(
+            'get_remote', 'Rate limit budget low for {}, deferring {}'.format(
+                limit.host, url))
+        return None
+    timeout = HOST_TIMEOUTS.get(breaker.host, TIMEOUT)
+    headers = dict(get_headers(url), **(headers or {}))
+    response = None
+    for attempt in range(retries + 1):
+        await asyncio.sleep(limit.take_slot())
+        try:
+            response = await loop.run_in_executor(None, functools.partial(
+                session.request, method, url, headers=headers,
+                timeout=timeout))
+        except requests.RequestException as error:
+            response = None
+            await LOGGER.debug('get_remote', '{} - {}'.format(url, error))
+        else:
+            limit.update(response.headers)
+            if response.status_code < 500 and response.status_code != 429:
+                breaker.success()
+                return response
+        if attempt < retries:
+            delay = min(BACKOFF_MAX, BACKOFF * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, delay))
+    breaker.failure()
+    await LOGGER.debug(
+        'get_remote', 'Giving up on {} after {} attempts'.format(
+            url, retries + 1))
+    return response
+
 
 async def get_default_repos():
-    """Return default repos."""
-    git_base = 'https://raw.githubusercontent.com/'
-    card = [git_base + 'custom-cards/information/master/repos.json']
-    component = [git_base + 'custom-components/information/master/repos.json']
-    python_script = [None]
-    return {'component': component,
-            'card': card,
-            'python_script': python_script}
+    """Return default repos for every registered resource type."""
+    from pyupdate.ha_custom import registry
+    repos = {}
+    for name, resource_type in registry.TYPES.items():
+        default = [GIT_BASE + repo for repo in resource_type.default_repos]
+        repos[name] = default or [None]
+    return repos
 
 
 async def get_repo_data(resource, extra_repos=None):
@@ -40,32 +240,273 @@ async def get_repo_data(resource, extra_repos=None):
     return repos
 
 
+def read_version(path, limit=None):
+    """Return the VERSION or __version__ declared in a python file.
+
+    If limit is set, only the first limit characters of the file are read.
+    """
+    return_value = ''
+    if os.path.isfile(path):
+        with open(path, 'r', errors='ignore') as local:
+            lines = local
+            if limit is not None:
+                header = local.read(limit + 1)
+                lines = header[:limit].splitlines()
+                if (len(header) > limit and lines
+                        and '\n' not in header[limit - 1:limit + 1]):
+                    # The last line is cut off in the middle.
+                    lines = lines[:-1]
+            for line in lines:
+                matcher = VERSION_RE.match(line)
+                if matcher:
+                    return_value = str(matcher.group(2))
+    return return_value
+
+
+def parse_requirements(source):
+    """Return the requirements declared in python source."""
+    requirements = None
+    for line in source.splitlines():
+        matcher = REQUIREMENTS_RE.match(line)
+        if matcher:
+            val = str(matcher.group(1))
+            val = val.replace('[', '')
+            val = val.replace(']', '')
+            val = val.replace(',', ' ')
+            val = val.replace("'", "")
+            requirements = val
+    if requirements is None:
+        return []
+    return [package for package in requirements.split(' ') if package]
+
+
+def build_sensor_data(domain, items):
+    """Return sensor data and the number of updates for installed items.
+
+    items yields (name, remote entry, local version, installed) tuples.
+    """
+    data = {'domain': domain, 'has_update': []}
+    count = 0
+    for name, entry, local_version, installed in items:
+        remote_version = entry.get('version')
+        if not installed or not remote_version:
+            continue
+        has_update = remote_version != local_version
+        if has_update:
+            count += 1
+            data['has_update'].append(name)
+        data[name] = {
+            "local": local_version,
+            "remote": remote_version,
+            "has_update": has_update,
+            "not_local": False,
+            "repo": entry.get('visit_repo'),
+            "change_log": entry.get('changelog'),
+        }
+    return [data, count]
+
+
+async def run_in_executor(executor, func, *args):
+    """Run func in executor, or inline if no executor is given."""
+    if executor is None:
+        return func(*args)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+def parse_manifest(content, keys=None):
+    """Parse a repos.json manifest.
+
+    If keys is given, only those attributes are kept for every entry.
+    """
+    manifest = json.loads(content)
+    if keys is None:
+        return manifest
+    return {name: {key: value for key, value in entry.items() if key in keys}
+            for name, entry in manifest.items() if isinstance(entry, dict)}
+
+
+async def fetch_manifest(url, keys=None, executor=None, session=None):
+    """Fetch and parse a repos.json manifest, return None on failure.
+
+    Entries are only cut down to keys when parsing in an executor, the
+    inline path keeps every attribute.
+    """
+    if executor is None:
+        keys = None
+    response = await get_remote(url, session=session)
+    if response is None or response.status_code != 200:
+        await LOGGER.warning(
+            'fetch_manifest', 'Could not get remote info for ' + url)
+        return None
+    try:
+        return await run_in_executor(
+            executor, parse_manifest, response.content, keys)
+    except ValueError:
+        await LOGGER.warning('fetch_manifest', 'Invalid json from ' + url)
+        return None
+
+
+async def get_catalog(owner, resource, urls, keys=None, executor=None,
+                      manager=None, force=False):
+    """Return the merged catalog of repo urls, shared by manager if set."""
+    if executor is None:
+        keys = None
+    if manager is not None:
+        return await manager.get_catalog(
+            owner, resource, urls, keys, executor, force)
+    manifests = []
+    for url in urls:
+        manifest = await fetch_manifest(url, keys, executor)
+        if manifest is not None:
+            manifests.append(manifest)
+    return merge_manifests(manifests)
+
+
+def merge_manifests(manifests):
+    """Merge manifests, later entries override attributes of earlier ones."""
+    merged = {}
+    for manifest in manifests:
+        for name, attrs in manifest.items():
+            entry = merged.setdefault(name, {})
+            entry.update(attrs)
+            entry['name'] = name
+    return merged
+
+
+async def fetch_file(remote_file, session=None):
+    """Return the content of a remote file, or None."""
+    response = await get_remote(
+        remote_file, priority=ratelimit.PRIORITY_INSTALLED, session=session)
+    if response is None or response.status_code != 200:
+        return None
+    return response.content
+
+
+async def get_size(remote_file, session=None):
+    """Return the size of a remote file from a HEAD request.
+
+    Returns -1 if the size is not reported, or None if the file is not
+    available.
+    """
+    response = await get_remote(
+        remote_file, priority=ratelimit.PRIORITY_INSTALLED, session=session,
+        method='head')
+    if response is None or response.status_code != 200:
+        return None
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return -1
+
+
+async def plan_downloads(downloads, manager=None):
+    """Add the size to planned downloads.
+
+    Downloads that already have a size are kept as is. Downloads marked
+    optional are dropped if the remote file does not exist.
+    """
+    planned = []
+    for download in downloads:
+        if 'size' in download:
+            planned.append(download)
+            continue
+        if manager is not None:
+            size = await manager.get_size(download['remote'])
+        else:
+            size = await get_size(download['remote'])
+        if size is None and download.get('optional'):
+            continue
+        download = dict(download)
+        download['size'] = size if size is not None and size >= 0 else None
+        planned.append(download)
+    return planned
+
+
+def make_plan(domain, downloads, requirements=None):
+    """Return an update plan with its estimated cost."""
+    requirements = requirements or []
+    return {'domain': domain,
+            'downloads': downloads,
+            'requirements': requirements,
+            'requests': len(downloads),
+            'bytes': sum(download['size'] or 0 for download in downloads),
+            'unknown_sizes': len(
+                [download for download in downloads
+                 if download['size'] is None]),
+            'pip_installs': 1 if requirements else 0}
+
+
+async def plan_all(*handlers):
+    """Return a combined update plan for handlers."""
+    plans = [await handler.plan() for handler in handlers]
+    return {'plans': plans,
+            'requests': sum(plan['requests'] for plan in plans),
+            'bytes': sum(plan['bytes'] for plan in plans),
+            'unknown_sizes': sum(plan['unknown_sizes'] for plan in plans),
+            'pip_installs': sum(plan['pip_installs'] for plan in plans)}
+
+
+async def execute_all(plan, *handlers):
+    """Execute a combined update plan with the handlers it was made from."""
+    for handler, handler_plan in zip(handlers, plan['plans']):
+        await handler.execute(handler_plan)
+
+
+async def execute_downloads(downloads, manager=None, fetched=None):
+    """Download planned files grouped by host, return the ones that worked.
+
+    Identical downloads are only done once. Content already fetched while
+    planning can be passed in fetched, {remote: content}, and is written
+    without downloading it again.
+    """
+    fetched = fetched or {}
+    done = []
+    seen = set()
+    for download in sorted(
+            downloads, key=lambda download: get_host(download['remote'])):
+        key = (download['remote'], download['local'])
+        if key in seen:
+            continue
+        seen.add(key)
+        if await download_file(
+                download['local'], download['remote'], manager,
+                fetched.get(download['remote'])):
+            done.append(download)
+    return done
+
+
 async def check_local_premissions(file):
     """Check premissions of a file."""
     dirpath = os.path.dirname(file)
     return os.access(dirpath, os.W_OK)
 
 
-async def check_remote_access(file):
+async def check_remote_access(file, priority=ratelimit.PRIORITY_INSTALLED):
     """Check access to remote file."""
-    returnvalue = False
-    try:
-        test_remote_file = requests.get(file)
-        returnvalue = bool(test_remote_file.status_code == 200)
-    except Exception:  # pylint: disable=W0703
+    response = await get_remote(file, priority=priority)
+    returnvalue = bool(response is not None and response.status_code == 200)
+    if not returnvalue:
         await LOGGER.debug('check_remote_access', 'no access to ' + file)
     return returnvalue
 
 
-async def download_file(local_file, remote_file):
-    """Download a file."""
+async def download_file(local_file, remote_file, manager=None, content=None):
+    """Download a file, through the manager download cache if set.
+
+    If content is given it is written instead of downloading the file.
+    """
     await LOGGER.debug(
         'download_file',
         "Downloading '{}' to '{}'".format(remote_file, local_file))
     if await check_local_premissions(local_file):
-        if await check_remote_access(remote_file):
+        if content is None and manager is not None:
+            content = await manager.get_file(remote_file)
+        elif content is None:
+            content = await fetch_file(remote_file)
+        if content is not None:
             with open(local_file, 'wb') as file:
-                file.write(requests.get(remote_file).content)
+                file.write(content)
             file.close()
             retrun_value = True
         else:
@@ -89,20 +530,159 @@ async def normalize_path(path):
     return path
 
 
+def make_tempfile(path):
+    """Create a temporary file next to path to be moved over it later.
+
+    The temporary file gets the mode and, when allowed, the owner of path.
+    If path does not exist yet it gets the default mode for new files.
+    Returns the open file descriptor and the name of the temporary file.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    tmpfile = os.path.join(directory, '.{}.{}.tmp'.format(
+        name, os.urandom(6).hex()))
+    # Mode 0o666 lets the umask decide, as for any newly created file.
+    handle = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return handle, tmpfile
+    try:
+        shutil.copymode(path, tmpfile)
+        try:
+            os.chown(tmpfile, stat.st_uid, stat.st_gid)
+        except (AttributeError, OSError):
+            # Only root may give files away, keep the writer as owner.
+            pass
+    except BaseException:
+        os.close(handle)
+        os.remove(tmpfile)
+        raise
+    return handle, tmpfile
+
+
+def rewrite_file(file, replacements):
+    """Apply all search/replace pairs to a file in a single pass.
+
+    The result is streamed to a temporary file next to the real file,
+    symlinks are resolved first, and moved in place once it is on disk.
+    If nothing matches, the temporary file is discarded and the file is
+    left untouched. Bytes that are not valid UTF-8 are kept as they are.
+    Returns the number of replacements made.
+    """
+    replacements = {search: replace for search, replace
+                    in replacements.items() if search}
+    if not replacements:
+        return 0
+    pattern = re.compile('|'.join(
+        re.escape(search)
+        for search in sorted(replacements, key=len, reverse=True)))
+    file = os.path.realpath(file)
+    count = 0
+    handle, tmpfile = make_tempfile(file)
+    try:
+        with open(file, encoding='utf-8', errors='surrogateescape',
+                  newline='') as source, \
+                os.fdopen(handle, 'w', encoding='utf-8',
+                          errors='surrogateescape', newline='') as target:
+            for line in source:
+                line, found = pattern.subn(
+                    lambda match: replacements[match.group(0)], line)
+                count += found
+                target.write(line)
+            if count:
+                # Make sure the new content is on disk before the rename,
+                # so a power cut never leaves an empty or partial file.
+                target.flush()
+                os.fsync(target.fileno())
+        if count:
+            os.replace(tmpfile, file)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+    return count
+
+
+def load_storage(path):
+    """Load pyupdate state from a .storage file.
+
+    Files are stored as {"version": 2, "key": key, "data": {...}}. Version 1
+    files hold the data dict directly and are returned as is, they are
+    migrated on the next save.
+    """
+    with open(path, encoding='utf-8', errors='ignore') as storagefile:
+        load = json.load(storagefile)
+    if not isinstance(load, dict):
+        raise ValueError('Unexpected content in {}'.format(path))
+    if isinstance(load.get('version'), int) and 'data' in load:
+        if load['version'] > STORAGE_VERSION:
+            raise ValueError('Unsupported version {} of {}'.format(
+                load['version'], path))
+        return load['data']
+    return load
+
+
+def save_storage(path, key, data):
+    """Save pyupdate state to a .storage file as compact json.
+
+    The file is written to a temporary file first and moved in place once
+    it is on disk, keeping the mode and owner of the existing file.
+    """
+    content = json.dumps(
+        {'version': STORAGE_VERSION, 'key': key, 'data': data},
+        separators=(',', ':'))
+    handle, tmpfile = make_tempfile(path)
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as outfile:
+            outfile.write(content)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmpfile, path)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+
+async def replace_many(file, replacements):
+    """Replace all occurrences of every search key in file."""
+    await LOGGER.debug(
+        'replace_many',
+        "Replacing {} in file '{}'".format(replacements, file))
+    return rewrite_file(file, replacements)
+
+
 async def replace_all(file, search, replace):
     """Replace all occupancies of search in file."""
     await LOGGER.debug(
         'replace_all',
         "Replacing all '{}' with '{}' in file '{}'".format(
             search, replace, file))
-    for line in fileinput.input(file, inplace=True):
-        if search in line:
-            line = line.replace(search, replace)
-        sys.stdout.write(line)
+    return rewrite_file(file, {search: replace})
+
+
+async def pip_install(packages):
+    """Run pip install --upgrade without blocking the event loop.
+
+    pip runs in the default executor rather than through
+    asyncio.create_subprocess_exec, which needs a child watcher that is
+    only attached to the main thread loop on Python 3.6/3.7.
+    Returns the pip exit code.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, subprocess.call, [
+        sys.executable, "-m", "pip", "install", "--upgrade"] + list(packages))
+
+
+async def update_many(packages):
+    """Update pip packages with a single pip call."""
+    packages = [package for package in packages if package]
+    if not packages:
+        return
+    await LOGGER.debug('update_many', 'Starting upgrade of {}'.format(
+        ' '.join(packages)))
+    await pip_install(packages)
 
 
 async def update(package):
     """Update a pip package."""
     await LOGGER.debug('update', 'Starting upgrade of {}'.format(package))
-    subprocess.call(
-        [sys.executable, "-m", "pip", "install", "--upgrade", package])
+    await pip_install([package])
@@ -1,97 +1,111 @@
 """Logic to handle custom_cards."""
 import json
 import os
-from typing import IO, Any
 
-import requests
-from requests import RequestException
-import yaml
-from pyupdate.ha_custom import common
-from pyupdate.log import Logger
+from pyupdate.ha_custom import common, ratelimit, registry
 
+LOADER = None
+STORAGE_KEY = 'custom_updater.cards'
+CATALOG_KEYS = registry.get_type('card').catalog_keys
 
-class Loader(yaml.SafeLoader):
-    """YAML Loader with `!include` constructor."""
 
-    def __init__(self, stream: IO) -> None:
-        """Initialise Loader."""
-        try:
-            self._root = os.path.split(stream.name)[0]
-        except AttributeError:
-            self._root = os.path.curdir
+def get_loader():
+    """Return the YAML Loader with `!include` constructor.
 
-        super().__init__(stream)
+    yaml is imported and the constructor registered on first use, so
+    importing this module stays cheap for users in storage mode.
+    """
+    global LOADER  # pylint: disable=W0603
+    if LOADER is not None:
+        return LOADER
+    import yaml
 
+    class Loader(yaml.SafeLoader):
+        """YAML Loader with `!include` constructor."""
 
-def construct_include(loader: Loader, node: yaml.Node) -> Any:
+        def __init__(self, stream):
+            """Initialise Loader."""
+            try:
+                self._root = os.path.split(stream.name)[0]
+            except AttributeError:
+                self._root = os.path.curdir
+
+            super().__init__(stream)
+
+    yaml.add_constructor('!include', construct_include, Loader)
+    LOADER = Loader
+    return LOADER
+
+
+def construct_include(loader, node):
     """Include file referenced at node."""
+    import yaml
     filename = os.path.abspath(
         os.path.join(loader._root, loader.construct_scalar(node)))
     extension = os.path.splitext(filename)[1].lstrip('.')
 
     with open(filename, 'r', encoding='utf-8', errors='ignore') as localfile:
         if extension in ('yaml', 'yml'):
-            return yaml.load(localfile, Loader)
+            return yaml.load(localfile, get_loader())
         elif extension in ('json', ):
             return json.load(localfile)
         else:
             return ''.join(localfile.readlines())
 
 
-yaml.add_constructor('!include', construct_include, Loader)
+def compact_resources(resources):
+    """Return only the url and type of each resource."""
+    return [{'url': entry['url'], 'type': entry.get('type')}
+            for entry in resources or []
+            if isinstance(entry, dict) and 'url' in entry]
+
+
+def load_storage_resources(jsonfile):
+    """Parse the lovelace storage file and return its resources."""
+    with open(jsonfile, encoding='utf-8', errors='ignore') as localfile:
+        load = json.load(localfile)
+    return compact_resources(load['data']['config'].get('resources', []))
 
 
-class CustomCards():
-    """Custom_cards class."""
+def load_yaml_resources(yamlfile):
+    """Parse ui-lovelace.yaml and return its resources."""
+    import yaml
+    with open(yamlfile, encoding='utf-8', errors='ignore') as localfile:
+        load = yaml.load(localfile, get_loader())
+    return compact_resources(load.get('resources', []))
 
-    def __init__(self, base_dir, mode, skip, custom_repos):
-        """Init."""
-        self.base_dir = base_dir
+
+class CustomCards(registry.Resources):
+    """Custom_cards class.
+
+    Fetching, comparing, planning and installing is done by the shared
+    Resources pipeline of the card type. This class only adds where cards
+    live, which comes from the lovelace config, and the installed versions
+    kept in .storage.
+    """
+
+    def __init__(self, base_dir, mode, skip, custom_repos, executor=None,
+                 manager=None):
+        """Init.
+
+        If executor is set, lovelace configs and manifests are parsed there
+        instead of on the event loop. If manager is set, remote data is
+        shared through it.
+        """
+        super().__init__('card', base_dir, custom_repos, executor, manager)
         self.mode = mode
         self.skip = skip
-        self.log = Logger(self.__class__.__name__)
         self.local_cards = []
         self.super_custom_url = []
-        self.custom_repos = custom_repos
-        self.remote_info = None
         self.resources = None
 
+    async def repo_urls(self):
+        """Return the extra repos.json urls, including tracked cards."""
+        return list(self.custom_repos) + list(self.super_custom_url)
+
     async def get_info_all_cards(self, force=False):
         """Return all remote info if any."""
-        await self.log.debug('get_info_all_cards', 'Started')
-        if not force and self.remote_info is not None:
-            await self.log.debug('get_info_all_cards', 'Using stored data')
-            return self.remote_info
-        remote_info = {}
-        allcustom = []
-        for url in self.custom_repos:
-            allcustom.append(url)
-        for url in self.super_custom_url:
-            allcustom.append(url)
-        repos = await common.get_repo_data('card', allcustom)
-        for url in repos:
-            try:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    for name, card in response.json().items():
-                        try:
-                            if name in remote_info:
-                                entry = remote_info.get(name, {})
-                            else:
-                                entry = {}
-                            for attr in card:
-                                entry['name'] = name
-                                entry[attr] = card[attr]
-                            remote_info[name] = entry
-                        except KeyError:
-                            print('Could not get remote info for ' + name)
-            except RequestException:
-                print('Could not get remote info for ' + url)
-        self.remote_info = remote_info
-        stats = {'count': len(remote_info), 'cards': remote_info.keys()}
-        await self.log.debug(
-            'get_info_all_cards', 'Updated stored data ' + str(stats))
-        return remote_info
+        return await self.get_info_all(force)
 
     async def init_local_data(self):
         """Init new version file."""
@@ -116,60 +130,33 @@ class CustomCards():
                 await self.local_data(
                     name=card, action='set', version=version, localdir=path)
 
-    async def get_sensor_data(self):
+    async def get_sensor_data(self, force=False):
         """Get sensor data."""
         await self.log.debug('get_sensor_data', 'Started')
         if not self.local_cards:
             await self.localcards()
-        cards = await self.get_info_all_cards()
-        await self.log.debug(
-            'get_sensor_data', 'Number of cards: ' + str(len(cards.keys())))
-        await self.log.debug(
-            'get_sensor_data', 'Cards: ' + str(cards.keys()))
-        cahce_data = {}
-        cahce_data['domain'] = 'custom_cards'
-        cahce_data['has_update'] = []
-        count_updateable = 0
-        if cards:
-            for card in cards:
-                if card not in self.local_cards:
-                    continue
-                remote_version = cards[card]['version']
-                local_version = await self.get_local_version(
-                    cards[card]['name'])
-                has_update = (
-                    remote_version and remote_version != local_version)
-                carddir = await self.get_card_dir(cards[card]['name'])
-                not_local = True if carddir is None else False
-                if (not not_local and remote_version):
-                    if has_update and not not_local:
-                        count_updateable = count_updateable + 1
-                        cahce_data['has_update'].append(cards[card]['name'])
-                    cahce_data[cards[card]['name']] = {
-                        "local": local_version,
-                        "remote": remote_version,
-                        "has_update": has_update,
-                        "not_local": not_local,
-                        "repo": cards[card]['visit_repo'],
-                        "change_log": cards[card]['changelog'],
-                    }
-        await self.log.debug(
-            'get_sensor_data',
-            'get_sensor_data: [{}, {}]'.format(cahce_data, count_updateable))
-        return [cahce_data, count_updateable]
-
-    async def update_all(self):
-        """Update all cards."""
-        await self.log.debug('update_all', 'Started')
-        updates = await self.get_sensor_data()
-        updates = updates[0]['has_update']
-        if updates is not None:
-            await self.log.info('update_all', updates)
-            for name in updates:
-                await self.upgrade_single(name)
-            await self.get_info_all_cards(force=True)
-        else:
-            await self.log.info('update_all', 'No updates avaiable')
+        return await super().get_sensor_data(force)
+
+    async def local_state(self, name, entry, scanned):
+        """Return (local version, installed) of a card used in lovelace."""
+        if name not in self.local_cards:
+            return None
+        local_version = await self.get_local_version(name)
+        carddir = await self.get_card_dir(name)
+        return local_version, carddir is not None
+
+    async def local_file(self, name, entry):
+        """Return the local path of a card, None if lovelace lacks it."""
+        card_dir = await self.get_card_dir(name)
+        if card_dir is None:
+            return None
+        return card_dir + name + '.js'
+
+    async def downloaded(self, done):
+        """Store the new version of every card that was written."""
+        for download in done:
+            if not download.get('extra'):
+                await self.update_resource_version(download['name'])
 
     async def force_reload(self):
         """Force data refresh."""
@@ -183,44 +170,6 @@ class CustomCards():
         await self.super_custom()
         await self.get_sensor_data()
 
-    async def upgrade_single(self, name):
-        """Update one card."""
-        await self.log.info('upgrade_single', 'Started')
-        remote_info = await self.get_info_all_cards()
-        remote_info = remote_info[name]
-        remote_file = remote_info['remote_location']
-        local_file = await self.get_card_dir(name) + name + '.js'
-        await common.download_file(local_file, remote_file)
-        await self.upgrade_lib(name)
-        await self.upgrade_editor(name)
-        await self.update_resource_version(name)
-        await self.log.info('upgrade_single', 'Finished ' + name)
-
-    async def upgrade_lib(self, name):
-        """Update one card-lib."""
-        await self.log.debug('upgrade_lib', 'Started')
-        remote_info = await self.get_info_all_cards()
-        remote_info = remote_info[name]
-        remote_file = remote_info['remote_location'][:-3] + '.lib.js'
-        local_file = await self.get_card_dir(name) + name + '.lib.js'
-        await common.download_file(local_file, remote_file)
-
-    async def upgrade_editor(self, name):
-        """Update one card-editor."""
-        await self.log.debug('upgrade_editor', 'Started')
-        remote_info = await self.get_info_all_cards()
-        remote_info = remote_info[name]
-        remote_file = remote_info['remote_location'][:-3] + '-editor.js'
-        local_file = await self.get_card_dir(name) + name + '-editor.js'
-        await common.download_file(local_file, remote_file)
-
-    async def install(self, name):
-        """Install single card."""
-        await self.log.debug('install', 'Started')
-        sdata = await self.get_sensor_data()
-        if name in sdata[0]:
-            await self.upgrade_single(name)
-
     async def update_resource_version(self, name):
         """Update the ui-lovelace file."""
         await self.log.debug('update_resource_version', 'Started')
@@ -283,7 +232,12 @@ class CustomCards():
 
     async def local_data(
             self, name=None, action='get', version=None, localdir=None):
-        """Write or get info from storage."""
+        """Write or get info from storage.
+
+        If the storage file exists but cannot be loaded, for example
+        because it is corrupt or written by a newer version, it is never
+        overwritten.
+        """
         await self.log.debug('local_data', 'Started')
         data = {'action': action,
                 'name': name,
@@ -291,15 +245,15 @@ class CustomCards():
                 'dir': localdir}
         await self.log.debug('local_data', data)
         returnvalue = None
-        jsonfile = "{}/.storage/custom_updater.cards".format(self.base_dir)
+        jsonfile = "{}/.storage/{}".format(self.base_dir, STORAGE_KEY)
+        loaded = True
         if os.path.isfile(jsonfile):
-            with open(jsonfile, encoding='utf-8',
-                      errors='ignore') as storagefile:
-                try:
-                    load = json.load(storagefile)
-                except Exception as error:  # pylint: disable=W0703
-                    load = {}
-                    await self.log.error('local_data', error)
+            try:
+                load = common.load_storage(jsonfile)
+            except Exception as error:  # pylint: disable=W0703
+                load = {}
+                loaded = False
+                await self.log.error('local_data', error)
         else:
             load = {}
 
@@ -310,29 +264,30 @@ class CustomCards():
                 returnvalue = load.get(name, {})
         else:
             card = load.get(name, {})
+            current = dict(card)
             if version is not None:
                 card['version'] = version
             if localdir is not None:
                 card['dir'] = localdir
-            load[name] = card
-            with open(jsonfile, 'w', encoding='utf-8',
-                      errors='ignore') as outfile:
-                json.dump(load, outfile, indent=4)
-                outfile.close()
+            if not loaded:
+                await self.log.error(
+                    'local_data',
+                    'Not saving {}, {} could not be loaded'.format(
+                        name, jsonfile))
+            elif name not in load or card != current:
+                load[name] = card
+                common.save_storage(jsonfile, STORAGE_KEY, load)
         await self.log.debug('local_data', returnvalue)
         return returnvalue
 
     async def storage_resources(self):
         """Load resources from storage."""
         await self.log.debug('storage_resources', 'Started')
-        resources = {}
+        resources = []
         jsonfile = "{}/.storage/lovelace".format(self.base_dir)
         if os.path.isfile(jsonfile):
-            with open(jsonfile, encoding='utf-8',
-                      errors='ignore') as localfile:
-                load = json.load(localfile)
-                resources = load['data']['config'].get('resources', {})
-                localfile.close()
+            resources = await common.run_in_executor(
+                self.executor, load_storage_resources, jsonfile)
         else:
             await self.log.error(
                 'storage_resources',
@@ -343,14 +298,11 @@ class CustomCards():
     async def yaml_resources(self):
         """Load resources from yaml."""
         await self.log.debug('yaml_resources', 'Started')
-        resources = {}
+        resources = []
         yamlfile = "{}/ui-lovelace.yaml".format(self.base_dir)
         if os.path.isfile(yamlfile):
-            with open(yamlfile, encoding='utf-8',
-                      errors='ignore') as localfile:
-                load = yaml.load(localfile, Loader)
-                resources = load.get('resources', {})
-                localfile.close()
+            resources = await common.run_in_executor(
+                self.executor, load_yaml_resources, yamlfile)
         else:
             await self.log.error(
                 'yaml_resources', 'Lovelace config in yaml file not found')
@@ -380,7 +332,7 @@ class CustomCards():
             if '/customcards/github' in url and (
                     '?track=true' in url or '?track=True' in url):
                 remote_exist = False
-                base = "https://raw.githubusercontent.com/"
+                base = common.GIT_BASE
                 clean = url.split('/customcards/github/')[1].split('.js')[0]
                 dev = clean.split('/')[0]
                 card = clean.split('/')[1]
@@ -418,8 +370,9 @@ class CustomCards():
                 if url.split('/master/')[0].split('/')[1] in self.remote_info:
                     card_dir = url.split('.com/')[1].split('/master')[0]
                 else:
-                    response = requests.get(url)
-                    if response.status_code == 200:
+                    response = await common.get_remote(
+                        url, priority=ratelimit.PRIORITY_INSTALLED)
+                    if response is not None and response.status_code == 200:
                         if len(response.json()) != 1:
                             continue
                     card_dir = url.split('.com/')[1].split('/master')[0]
@@ -0,0 +1,308 @@
+"""Logic to share remote data between many Home Assistant config dirs."""
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+import weakref
+from pyupdate.ha_custom import common
+from pyupdate.ha_custom.custom_cards import CustomCards
+from pyupdate.ha_custom.custom_components import CustomComponents
+from pyupdate.ha_custom.python_scripts import PythonScripts
+from pyupdate.ha_custom.registry import Resources, ResourceType
+from pyupdate.log import Logger
+
+CACHE_TTL = 300
+FORCE_MIN_AGE = 60
+DOWNLOAD_CACHE_SIZE = 16 * 1024 * 1024
+
+
+class Manager():
+    """Own remote catalogs, connections and downloads for many instances.
+
+    Views handed out by the manager share one HTTP session, one parsed
+    manifest per repo url and one merged catalog per set of repos.
+    Manifests are reference counted by the views using them. Manifests
+    in use are kept as a fallback for failed refreshes, the others are
+    kept until they expire so views created later still share them.
+    Concurrent requests for the same data, from any thread or event loop,
+    share a single fetch.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, download_cache_size=DOWNLOAD_CACHE_SIZE):
+        """Init."""
+        import requests
+        self.ttl = ttl
+        self.download_cache_size = download_cache_size
+        self.session = requests.Session()
+        self.manifests = {}
+        self.catalogs = {}
+        self.downloads = collections.OrderedDict()
+        self.download_bytes = 0
+        self.sizes = {}
+        self.refs = collections.Counter()
+        self.owners = {}
+        self.inflight = {}
+        # Reentrant, finalizers may run while the lock is held.
+        self.lock = threading.RLock()
+        self.log = Logger(self.__class__.__name__)
+
+    def components(self, base_dir, custom_repos=None, executor=None):
+        """Return a CustomComponents view for base_dir."""
+        return CustomComponents(
+            base_dir, custom_repos or [], executor=executor, manager=self)
+
+    def cards(self, base_dir, mode='yaml', skip=None, custom_repos=None,
+              executor=None):
+        """Return a CustomCards view for base_dir."""
+        return CustomCards(
+            base_dir, mode, skip or [], custom_repos or [],
+            executor=executor, manager=self)
+
+    def python_scripts(self, base_dir, custom_repos=None, executor=None):
+        """Return a PythonScripts view for base_dir."""
+        return PythonScripts(
+            base_dir, custom_repos or [], executor=executor, manager=self)
+
+    def resources(self, resource_type, base_dir, custom_repos=None,
+                  executor=None, **options):
+        """Return a view of a registered type for base_dir.
+
+        Built-in types get their own handler, options are passed on to it,
+        e.g. mode and skip for cards. Other types use Resources.
+        """
+        views = {'component': self.components,
+                 'card': self.cards,
+                 'python_script': self.python_scripts}
+        name = resource_type
+        if isinstance(resource_type, ResourceType):
+            name = resource_type.name
+        if name in views:
+            return views[name](
+                base_dir, custom_repos=custom_repos, executor=executor,
+                **options)
+        return Resources(
+            resource_type, base_dir, custom_repos, executor=executor,
+            manager=self)
+
+    def acquire(self, owner, urls):
+        """Register that owner uses the manifests at urls.
+
+        The references are released automatically if owner is garbage
+        collected without calling release().
+        """
+        with self.lock:
+            if id(owner) not in self.owners:
+                self.owners[id(owner)] = (set(), weakref.finalize(
+                    owner, self.release_id, id(owner)))
+            used = self.owners[id(owner)][0]
+            for url in urls:
+                if url not in used:
+                    used.add(url)
+                    self.refs[url] += 1
+
+    def release(self, owner):
+        """Release all manifests used by owner."""
+        with self.lock:
+            entry = self.owners.get(id(owner))
+        if entry is not None:
+            entry[1]()
+
+    def release_id(self, owner_id):
+        """Release all manifests used by the owner with that id."""
+        with self.lock:
+            used = self.owners.pop(owner_id, (set(), None))[0]
+            for url in used:
+                self.refs[url] -= 1
+                if self.refs[url] <= 0:
+                    del self.refs[url]
+            self.prune()
+
+    def prune(self):
+        """Drop expired manifests and catalogs no view uses any more."""
+        with self.lock:
+            for key in [key for key, (fetched, _) in self.manifests.items()
+                        if key[0] not in self.refs
+                        and self.expired(fetched, False)]:
+                del self.manifests[key]
+            for key in [key for key, (fetched, _) in self.catalogs.items()
+                        if not any(url in self.refs for url in key[1])
+                        and self.expired(fetched, False)]:
+                del self.catalogs[key]
+
+    def expired(self, fetched, force):
+        """Return True if data fetched at that time should be refreshed."""
+        age = time.monotonic() - fetched
+        return age >= self.ttl or (force and age >= FORCE_MIN_AGE)
+
+    async def shared(self, key, fetch):
+        """Run fetch() once for key, concurrent callers await its result.
+
+        If the caller running fetch() is cancelled, the cancellation is
+        not passed on: a waiting caller takes over and fetches instead.
+        """
+        while True:
+            with self.lock:
+                future = self.inflight.get(key)
+                leader = future is None or future.cancelled()
+                if leader:
+                    future = concurrent.futures.Future()
+                    self.inflight[key] = future
+            if leader:
+                break
+            await self.wait_for(future)
+            if not future.cancelled():
+                return future.result()
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            with self.lock:
+                if self.inflight.get(key) is future:
+                    del self.inflight[key]
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self.lock:
+                if self.inflight.get(key) is future:
+                    del self.inflight[key]
+        return result
+
+    @staticmethod
+    async def wait_for(future):
+        """Wait until a fetch shared with another thread or loop is done.
+
+        Unlike asyncio.wrap_future, cancelling the waiter does not cancel
+        the shared fetch.
+        """
+        loop = asyncio.get_event_loop()
+        done = loop.create_future()
+
+        def wake():
+            """Mark the waiter done, in its own loop."""
+            if not done.done():
+                done.set_result(None)
+
+        def callback(_):
+            """Wake the waiter from the thread that finished the fetch."""
+            try:
+                loop.call_soon_threadsafe(wake)
+            except RuntimeError:
+                # The waiting loop is already closed.
+                pass
+
+        future.add_done_callback(callback)
+        await done
+
+    async def get_manifest(self, url, keys=None, executor=None, force=False):
+        """Return the shared parsed manifest for url."""
+        key = (url, keys)
+
+        async def fetch():
+            """Fetch the manifest unless another caller just did."""
+            with self.lock:
+                cached = self.manifests.get(key)
+            if cached is not None and not self.expired(cached[0], force):
+                return cached[1]
+            manifest = await common.fetch_manifest(
+                url, keys, executor, self.session)
+            if manifest is None:
+                return cached[1] if cached is not None else None
+            with self.lock:
+                self.manifests[key] = (time.monotonic(), manifest)
+            return manifest
+
+        with self.lock:
+            cached = self.manifests.get(key)
+        if cached is not None and not self.expired(cached[0], force):
+            return cached[1]
+        return await self.shared(('manifest',) + key, fetch)
+
+    async def get_catalog(self, owner, resource, urls, keys=None,
+                          executor=None, force=False):
+        """Return the shared merged catalog for a set of repo urls."""
+        self.prune()
+        self.acquire(owner, urls)
+        key = (resource, tuple(urls), keys)
+
+        async def fetch():
+            """Build the catalog unless another caller just did."""
+            with self.lock:
+                cached = self.catalogs.get(key)
+            if cached is not None and not self.expired(cached[0], force):
+                return cached[1]
+            manifests = []
+            for url in urls:
+                manifest = await self.get_manifest(
+                    url, keys, executor, force)
+                if manifest is not None:
+                    manifests.append(manifest)
+            catalog = common.merge_manifests(manifests)
+            with self.lock:
+                self.catalogs[key] = (time.monotonic(), catalog)
+            return catalog
+
+        with self.lock:
+            cached = self.catalogs.get(key)
+        if cached is not None and not self.expired(cached[0], force):
+            return cached[1]
+        return await self.shared(('catalog',) + key, fetch)
+
+    async def get_file(self, remote_file):
+        """Return the content of a remote file from the download cache."""
+        with self.lock:
+            cached = self.downloads.get(remote_file)
+            if cached is not None and not self.expired(cached[0], False):
+                self.downloads.move_to_end(remote_file)
+                return cached[1]
+        return await self.shared(
+            ('file', remote_file), lambda: self.fetch_file(remote_file))
+
+    async def fetch_file(self, remote_file):
+        """Download a file into the download cache."""
+        content = await common.fetch_file(remote_file, self.session)
+        if content is None:
+            return None
+        with self.lock:
+            old = self.downloads.pop(remote_file, None)
+            if old is not None:
+                self.download_bytes -= len(old[1])
+            self.downloads[remote_file] = (time.monotonic(), content)
+            self.download_bytes += len(content)
+            while (self.download_bytes > self.download_cache_size
+                   and len(self.downloads) > 1):
+                _, (_, evicted) = self.downloads.popitem(last=False)
+                self.download_bytes -= len(evicted)
+        return content
+
+    async def get_size(self, remote_file):
+        """Return the size of a remote file, from cache when possible."""
+        with self.lock:
+            cached = self.downloads.get(remote_file)
+            if cached is not None:
+                return len(cached[1])
+            cached = self.sizes.get(remote_file)
+        if cached is not None and not self.expired(cached[0], False):
+            return cached[1]
+        return await self.shared(
+            ('size', remote_file), lambda: self.fetch_size(remote_file))
+
+    async def fetch_size(self, remote_file):
+        """Look up the size of a remote file and cache it."""
+        size = await common.get_size(remote_file, self.session)
+        with self.lock:
+            self.sizes[remote_file] = (time.monotonic(), size)
+        return size
+
+    async def state(self):
+        """Return cache statistics."""
+        with self.lock:
+            return {'views': len(self.owners),
+                    'manifests': len(self.manifests),
+                    'catalogs': len(self.catalogs),
+                    'downloads': len(self.downloads),
+                    'download_bytes': self.download_bytes}
@@ -0,0 +1,159 @@
+"""Logic to poll repo manifests in the background."""
+import asyncio
+import hashlib
+import random
+import time
+from pyupdate.ha_custom import common
+from pyupdate.log import Logger
+
+MIN_INTERVAL = 300
+MAX_INTERVAL = 6 * 60 * 60
+BACKOFF_FACTOR = 1.5
+JITTER = 0.1
+
+
+class Repo():
+    """Polling state for a single repo manifest."""
+
+    def __init__(self, url, interval):
+        """Init."""
+        self.url = url
+        self.interval = interval
+        self.digest = None
+        self.checked = None
+        self.changed = None
+
+    def as_dict(self):
+        """Return the polling state."""
+        return {'url': self.url,
+                'interval': self.interval,
+                'checked': self.checked,
+                'changed': self.changed}
+
+
+class Poller():
+    """Poll repo manifests, each on its own adaptive interval."""
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 factor=BACKOFF_FACTOR, executor=None):
+        """Init."""
+        self.executor = executor
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.repos = {}
+        self.tasks = {}
+        self.subscribers = []
+        self.running = False
+        self.log = Logger(self.__class__.__name__)
+
+    def subscribe(self, callback):
+        """Register callback(url, manifest), return a function to remove it.
+
+        The callback may be a plain function or a coroutine function.
+        """
+        self.subscribers.append(callback)
+
+        def unsubscribe():
+            """Remove the callback."""
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+        return unsubscribe
+
+    async def add_repo(self, url):
+        """Start tracking a repo manifest."""
+        if url in self.repos:
+            return
+        self.repos[url] = Repo(url, self.min_interval)
+        if self.running:
+            self.tasks[url] = asyncio.ensure_future(self.run(url))
+
+    async def add_resource(self, resource, extra_repos=None):
+        """Start tracking all repos for a resource type."""
+        for url in await common.get_repo_data(resource, extra_repos):
+            await self.add_repo(url)
+
+    async def remove_repo(self, url):
+        """Stop tracking a repo manifest."""
+        self.repos.pop(url, None)
+        task = self.tasks.pop(url, None)
+        if task is not None:
+            task.cancel()
+
+    async def start(self):
+        """Start polling all tracked repos."""
+        await self.log.debug('start', 'Polling {} repos'.format(
+            len(self.repos)))
+        self.running = True
+        for url in self.repos:
+            if url not in self.tasks:
+                self.tasks[url] = asyncio.ensure_future(self.run(url))
+
+    async def stop(self):
+        """Stop polling."""
+        self.running = False
+        tasks = list(self.tasks.values())
+        self.tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, url):
+        """Poll a single repo until stopped."""
+        # Spread the first poll of every repo over the shortest interval.
+        await asyncio.sleep(random.uniform(0, self.min_interval))
+        while url in self.repos:
+            await self.poll(url)
+            repo = self.repos.get(url)
+            if repo is None:
+                break
+            await asyncio.sleep(
+                repo.interval * random.uniform(1 - JITTER, 1 + JITTER))
+
+    async def poll(self, url):
+        """Fetch a repo manifest and adapt its interval.
+
+        Returns True if the manifest changed since the last poll.
+        """
+        repo = self.repos[url]
+        repo.checked = time.time()
+        response = await common.get_remote(url)
+        if response is None or response.status_code != 200:
+            await self.log.debug('poll', 'Could not fetch ' + url)
+            self.backoff(repo)
+            return False
+        digest = hashlib.sha1(response.content).hexdigest()
+        if digest == repo.digest:
+            self.backoff(repo)
+            return False
+        repo.digest = digest
+        try:
+            manifest = await common.run_in_executor(
+                self.executor, common.parse_manifest, response.content)
+        except ValueError:
+            await self.log.warning('poll', 'Invalid json from ' + url)
+            self.backoff(repo)
+            return False
+        repo.changed = repo.checked
+        repo.interval = self.min_interval
+        await self.log.debug('poll', 'Change detected for ' + url)
+        await self.publish(url, manifest)
+        return True
+
+    def backoff(self, repo):
+        """Poll a repo less often."""
+        repo.interval = min(self.max_interval, repo.interval * self.factor)
+
+    async def publish(self, url, manifest):
+        """Send a changed manifest to all subscribers."""
+        for callback in list(self.subscribers):
+            try:
+                result = callback(url, manifest)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as error:  # pylint: disable=W0703
+                await self.log.error('publish', error)
+
+    async def state(self):
+        """Return the polling state for all tracked repos."""
+        return {url: repo.as_dict() for url, repo in self.repos.items()}
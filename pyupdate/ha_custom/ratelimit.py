@@ -0,0 +1,81 @@
+"""Logic to handle remote rate limits."""
+import threading
+import time
+
+PRIORITY_INSTALLED = 0
+PRIORITY_DEFAULT = 1
+RESERVE = 10
+MAX_SPACING = 5
+
+
+class RateLimit():
+    """Request budget for a remote host, based on rate limit headers."""
+
+    def __init__(self, host, reserve=RESERVE):
+        """Init."""
+        self.host = host
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def update(self, headers):
+        """Update the budget from X-RateLimit-* response headers."""
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset'])
+            limit = int(headers.get('X-RateLimit-Limit', remaining))
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.lock:
+            self.limit = limit
+            self.remaining = remaining
+            self.reset = reset
+
+    @property
+    def active(self):
+        """Return True if the host has reported a budget for this window."""
+        return self.reset is not None and time.time() < self.reset
+
+    def allow(self, priority=PRIORITY_DEFAULT):
+        """Return True if a request with this priority should be sent.
+
+        Requests for installed items may use the whole budget, everything
+        else leaves the reserve untouched.
+        """
+        if not self.active or self.remaining is None:
+            return True
+        if priority <= PRIORITY_INSTALLED:
+            return self.remaining > 0
+        return self.remaining > self.reserve
+
+    def spacing(self):
+        """Return seconds between requests to spread the remaining budget."""
+        if not self.active or self.remaining is None:
+            return 0
+        window = self.reset - time.time()
+        return min(MAX_SPACING, window / max(self.remaining, 1))
+
+    def take_slot(self):
+        """Reserve the next request slot, return seconds to wait for it.
+
+        The slot is taken under a lock, so concurrent callers from other
+        tasks or threads get consecutive slots instead of a burst.
+        """
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.last + self.spacing())
+            self.last = slot
+            if self.active and self.remaining:
+                self.remaining -= 1
+        return slot - now
+
+    def as_dict(self):
+        """Return the budget state."""
+        return {'host': self.host,
+                'limit': self.limit,
+                'remaining': self.remaining,
+                'reset': self.reset,
+                'spacing': round(self.spacing(), 2)}
@@ -0,0 +1,413 @@
+"""Registry of resource types sharing one fetch/compare/install pipeline."""
+import os
+import sys
+import threading
+from pyupdate.ha_custom import common
+from pyupdate.log import Logger
+
+CATALOG_KEYS = ('version', 'local_location', 'remote_location', 'visit_repo',
+                'changelog')
+HEADER_SIZE = 4096
+TYPES = {}
+
+
+class ResourceType():
+    """A kind of resource tracked in repos.json manifests.
+
+    Subclasses override the hooks below to describe where a resource
+    lives, how its installed version is read, which extra files come with
+    it and which pip requirements it declares. Fetching, caching,
+    comparing and installing is done by Resources.
+    """
+
+    # Set if the main file declares REQUIREMENTS to install with pip.
+    has_requirements = False
+
+    def __init__(self, name, domain, default_repos=(),
+                 catalog_keys=CATALOG_KEYS):
+        """Init."""
+        self.name = name
+        self.domain = domain
+        self.default_repos = tuple(default_repos)
+        self.catalog_keys = tuple(catalog_keys)
+
+    async def local_file(self, base_dir, name, entry):
+        """Return the local path of a resource."""
+        return os.path.join(
+            base_dir, await common.normalize_path(entry['local_location']))
+
+    async def local_version(self, path, name):
+        """Return the installed version of a resource, '' if not installed."""
+        return common.read_version(path)
+
+    async def scan(self, base_dir):
+        """Return {path: version} of installed resources found in one pass.
+
+        Types that do not scan return {} and versions are read one by one
+        with local_version.
+        """
+        return {}
+
+    async def extra_downloads(self, name, entry, local_file):
+        """Return the downloads that come with the main file of a resource.
+
+        Every download is a dict with 'remote' and 'local', and may be
+        marked 'optional' if the remote file does not have to exist.
+        """
+        return []
+
+    def parse_requirements(self, source):
+        """Return the pip requirements declared in the main file."""
+        return []
+
+
+class ComponentType(ResourceType):
+    """custom_components, located relative to the config dir."""
+
+    has_requirements = True
+
+    def __init__(self, *args, **kwargs):
+        """Init."""
+        super().__init__(*args, **kwargs)
+        self.log = Logger(self.__class__.__name__)
+
+    async def local_file(self, base_dir, name, entry):
+        """Return the local path of a component."""
+        return base_dir + str(entry['local_location'])
+
+    async def local_version(self, path, name):
+        """Return the installed version of a component.
+
+        The version of a component Home Assistant has already imported is
+        read from the module, otherwise it is read from the file.
+        """
+        if '.' in name:
+            name = "{}.{}".format(name.split('.')[1], name.split('.')[0])
+        return_value = ''
+        if os.path.isfile(path):
+            package = "custom_components.{}".format(name)
+            if any(package in module for module in list(sys.modules)):
+                for attribute in ('__version__', 'VERSION'):
+                    try:
+                        return_value = getattr(
+                            __import__(package, fromlist=[attribute]),
+                            attribute)
+                    except Exception as err:  # pylint: disable=W0703
+                        await self.log.debug('local_version', str(err))
+                    if return_value != '':
+                        break
+        if return_value == '':
+            return_value = common.read_version(path)
+        return return_value
+
+    async def extra_downloads(self, name, entry, local_file):
+        """Return the extra resources listed for a component."""
+        directory = os.path.dirname(local_file)
+        return [{'remote': resource,
+                 'local': "{}/{}".format(directory, resource.split('/')[-1])}
+                for resource in entry.get('resources', [])]
+
+    def parse_requirements(self, source):
+        """Return the REQUIREMENTS declared by a component."""
+        return common.parse_requirements(source)
+
+
+class CardType(ResourceType):
+    """custom_cards, located through the lovelace config of a view.
+
+    Where a card lives and which version is installed depends on the
+    lovelace resources of a config dir, so cards are handled by
+    CustomCards, which overrides the view hooks of Resources.
+    """
+
+    async def local_file(self, base_dir, name, entry):
+        """Card locations are not part of the catalog."""
+        raise NotImplementedError(
+            'card locations come from the lovelace config, use CustomCards')
+
+    async def extra_downloads(self, name, entry, local_file):
+        """Return the optional lib and editor files of a card."""
+        return [{'remote': entry['remote_location'][:-3] + suffix,
+                 'local': local_file[:-3] + suffix,
+                 'optional': True}
+                for suffix in ('.lib.js', '-editor.js')]
+
+
+class PythonScriptType(ResourceType):
+    """python_scripts, found with a single scan of python_scripts/.
+
+    Only the first header_size characters of a script are read for its
+    version, and versions are cached by mtime and size for all views.
+    """
+
+    def __init__(self, *args, header_size=HEADER_SIZE, **kwargs):
+        """Init."""
+        super().__init__(*args, **kwargs)
+        self.header_size = header_size
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.log = Logger(self.__class__.__name__)
+
+    async def scan(self, base_dir):
+        """Return {path: version} for all scripts in python_scripts/."""
+        directory = os.path.normpath(os.path.join(base_dir, 'python_scripts'))
+        with self.lock:
+            previous = self.cache.get(directory, {})
+        scripts = {}
+        cache = {}
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.name.endswith('.py') or not entry.is_file():
+                continue
+            path = os.path.normpath(entry.path)
+            try:
+                stat = entry.stat()
+                key = (stat.st_mtime_ns, stat.st_size)
+                cached = previous.get(path)
+                if cached is not None and cached[0] == key:
+                    version = cached[1]
+                else:
+                    version = common.read_version(path, self.header_size)
+            except OSError as error:
+                await self.log.debug('scan', error)
+                continue
+            cache[path] = (key, version)
+            scripts[path] = version
+        with self.lock:
+            self.cache[directory] = cache
+        return scripts
+
+
+def register(resource_type):
+    """Register a resource type, replacing one with the same name."""
+    TYPES[resource_type.name] = resource_type
+    return resource_type
+
+
+def get_type(name):
+    """Return a registered resource type."""
+    return TYPES[name]
+
+
+class Resources():
+    """Fetch, compare and install resources of one registered type.
+
+    The view hooks repo_urls, local_state, local_file and downloaded
+    default to the resource type, subclasses override them when the
+    answer depends on the config dir, as for cards.
+    """
+
+    def __init__(self, resource_type, base_dir, custom_repos=None,
+                 executor=None, manager=None):
+        """Init.
+
+        resource_type is a ResourceType or the name of a registered one.
+        If executor is set, manifests are parsed there instead of on the
+        event loop. If manager is set, remote data is shared through it.
+        """
+        if not isinstance(resource_type, ResourceType):
+            resource_type = get_type(resource_type)
+        self.resource_type = resource_type
+        self.base_dir = base_dir
+        self.custom_repos = custom_repos or []
+        self.executor = executor
+        self.manager = manager
+        self.remote_info = {}
+        self.fetched = {}
+        self.log = Logger(self.__class__.__name__)
+
+    async def repo_urls(self):
+        """Return the extra repos.json urls of this view."""
+        return list(self.custom_repos)
+
+    async def get_info_all(self, force=False):
+        """Return all remote info if any."""
+        if not force and self.remote_info:
+            return self.remote_info
+        repos = await common.get_repo_data(
+            self.resource_type.name, await self.repo_urls())
+        self.remote_info = await common.get_catalog(
+            self, self.resource_type.name, repos,
+            self.resource_type.catalog_keys, self.executor, self.manager,
+            force)
+        await self.log.debug('get_info_all', '{} {}'.format(
+            len(self.remote_info), self.resource_type.name))
+        return self.remote_info
+
+    async def local_file(self, name, entry):
+        """Return the local path of a resource, None if it has none."""
+        return await self.resource_type.local_file(self.base_dir, name, entry)
+
+    async def local_state(self, name, entry, scanned):
+        """Return (local version, installed) of a resource.
+
+        scanned is the result of the resource type scan, versions found
+        there are used as is, including '' for no version. Returns None if
+        the resource is not tracked in this config dir.
+        """
+        try:
+            path = await self.local_file(name, entry)
+        except KeyError:
+            await self.log.debug(
+                'local_state', 'No local location for ' + name)
+            return None
+        if path is None:
+            return None
+        version = scanned.get(os.path.normpath(path))
+        if version is None:
+            # Not covered by the scan.
+            version = await self.resource_type.local_version(path, name)
+        return version, bool(version)
+
+    async def get_sensor_data(self, force=False):
+        """Get sensor data."""
+        catalog = await self.get_info_all(force)
+        scanned = await self.resource_type.scan(self.base_dir)
+        items = []
+        for name, entry in catalog.items():
+            state = await self.local_state(name, entry, scanned)
+            if state is not None:
+                items.append((name, entry) + tuple(state))
+        sensor_data = common.build_sensor_data(
+            self.resource_type.domain, items)
+        await self.log.debug('get_sensor_data', sensor_data)
+        return sensor_data
+
+    async def get_downloads(self, names):
+        """Return the downloads needed to update names.
+
+        The main file of every resource comes first, followed by its
+        extra files, which are marked 'extra'.
+        """
+        catalog = await self.get_info_all()
+        downloads = []
+        for name in names:
+            entry = catalog[name]
+            local_file = await self.local_file(name, entry)
+            if local_file is None:
+                await self.log.debug(
+                    'get_downloads', 'No local location for ' + name)
+                continue
+            downloads.append({'name': name,
+                              'remote': entry['remote_location'],
+                              'local': local_file})
+            for extra in await self.resource_type.extra_downloads(
+                    name, entry, local_file):
+                downloads.append(dict(extra, name=name, extra=True))
+        return downloads
+
+    async def get_file(self, remote_file):
+        """Return the content of a remote file, from the manager if set."""
+        if self.manager is not None:
+            return await self.manager.get_file(remote_file)
+        content = await common.fetch_file(remote_file)
+        if content is not None:
+            # Kept for execute(), which writes it without a new download.
+            self.fetched[remote_file] = content
+        return content
+
+    async def plan(self):
+        """Return the downloads and pip installs update_all would do.
+
+        For types with requirements, the new main file is fetched to read
+        them. execute() reuses it from the manager download cache, or
+        without a manager from the content kept by this view.
+        """
+        updates = await self.get_sensor_data()
+        self.fetched = {}
+        downloads = await self.get_downloads(updates[0]['has_update'])
+        requirements = []
+        if self.resource_type.has_requirements:
+            for download in downloads:
+                if download.get('extra'):
+                    continue
+                content = await self.get_file(download['remote'])
+                download['size'] = None if content is None else len(content)
+                download['requirements'] = (
+                    [] if content is None else
+                    self.resource_type.parse_requirements(
+                        content.decode('utf-8', 'replace')))
+                for package in download['requirements']:
+                    if package not in requirements:
+                        requirements.append(package)
+        downloads = await common.plan_downloads(downloads, self.manager)
+        plan = common.make_plan(
+            self.resource_type.domain, downloads, requirements)
+        await self.log.debug('plan', plan)
+        return plan
+
+    async def execute(self, plan):
+        """Run a plan made by plan(), installing requirements in one go."""
+        await self.install_downloads(plan['downloads'])
+        await self.get_info_all(force=True)
+
+    async def install_downloads(self, downloads):
+        """Download files and install the requirements of written ones.
+
+        Only resources whose main file was written get their requirements
+        installed. Returns the downloads that worked.
+        """
+        done = await common.execute_downloads(
+            downloads, self.manager, self.fetched)
+        self.fetched = {}
+        requirements = []
+        if self.resource_type.has_requirements:
+            for download in done:
+                if download.get('extra'):
+                    continue
+                packages = download.get('requirements')
+                if packages is None:
+                    with open(download['local'], 'r',
+                              errors='ignore') as local:
+                        packages = self.resource_type.parse_requirements(
+                            local.read())
+                for package in packages:
+                    if package not in requirements:
+                        requirements.append(package)
+        await common.update_many(requirements)
+        await self.downloaded(done)
+        await self.log.info(
+            'install_downloads', [download['name'] for download in done
+                                  if not download.get('extra')])
+        return done
+
+    async def downloaded(self, done):
+        """Run after downloads, done lists the ones that were written."""
+
+    async def update_all(self):
+        """Update all resources with a newer remote version."""
+        updates = await self.get_sensor_data()
+        await self.install_downloads(
+            await self.get_downloads(updates[0]['has_update']))
+        await self.get_info_all(force=True)
+
+    async def upgrade_single(self, name):
+        """Update one resource."""
+        await self.log.debug('upgrade_single', name + ' started')
+        await self.install_downloads(await self.get_downloads([name]))
+        await self.log.info('upgrade_single', name + ' finished')
+
+    async def install(self, name):
+        """Install a single resource."""
+        if name not in await self.get_info_all():
+            return False
+        downloads = await self.get_downloads([name])
+        if not downloads:
+            return False
+        os.makedirs(os.path.dirname(downloads[0]['local']), exist_ok=True)
+        done = await self.install_downloads(downloads)
+        return any(download is downloads[0] for download in done)
+
+
+register(ComponentType(
+    'component', 'custom_components',
+    ['custom-components/information/master/repos.json'],
+    CATALOG_KEYS + ('resources',)))
+register(CardType(
+    'card', 'custom_cards',
+    ['custom-cards/information/master/repos.json'],
+    ('version', 'remote_location', 'visit_repo', 'changelog')))
+register(PythonScriptType('python_script', 'python_scripts'))
@@ -1,27 +1,163 @@
 """Logic to handle pyupdate."""
+import re
 import subprocess
 import sys
-import json
-import requests
+import time
 
+PACKAGE = 'pyupdate'
+PYPI_URL = 'https://pypi.org/pypi'
+CACHE_TTL = 60 * 60
+TIMEOUT = (5, 15)
+CACHE = {}
 
-def update():
-    """Update this package."""
-    version = get_pypi_version()
-    packageversion = 'pyupdate' + version
+
+def update(base_url=PYPI_URL):
+    """Update this package if a newer version exists."""
+    version = get_pypi_version(base_url)
+    if not version or not is_newer(version[2:], get_installed_version()):
+        return False
+    packageversion = PACKAGE + version
     subprocess.call([sys.executable,
                      "-m",
                      "pip",
                      "install",
                      "--upgrade",
                      packageversion])
+    return True
 
 
-def get_pypi_version():
+def get_pypi_version(base_url=PYPI_URL):
     """Get the PyPi version of this package."""
-    url = 'https://pypi.org/pypi/pyupdate/json'
+    import requests
+    url = get_url(base_url)
+    cached = get_cached(url)
+    if cached is not None:
+        return format_version(cached)
+    try:
+        response = requests.get(
+            url, headers=get_cache_headers(url), timeout=TIMEOUT)
+        version = store_response(url, response)
+    except (requests.RequestException, ValueError, KeyError):
+        version = None
+    return format_version(version)
+
+
+async def async_get_pypi_version(base_url=PYPI_URL):
+    """Get the PyPi version of this package, return None if unknown."""
+    from pyupdate.ha_custom import common
+    url = get_url(base_url)
+    cached = get_cached(url)
+    if cached is not None:
+        return cached
+    response = await common.get_remote(url, headers=get_cache_headers(url))
+    if response is None:
+        return None
     try:
-        version = '==' + requests.get(url).json()['info']['version']
-    except json.decoder.JSONDecodeError:
-        version = ''
+        return store_response(url, response)
+    except (ValueError, KeyError):
+        return None
+
+
+async def async_check(base_url=PYPI_URL):
+    """Return the installed and latest version of this package."""
+    installed = get_installed_version()
+    latest = await async_get_pypi_version(base_url)
+    return {'installed': installed,
+            'latest': latest,
+            'has_update': bool(latest and is_newer(latest, installed))}
+
+
+async def async_update(base_url=PYPI_URL):
+    """Update this package if a newer version exists."""
+    from pyupdate.ha_custom import common
+    status = await async_check(base_url)
+    if not status['has_update']:
+        return False
+    await common.update(PACKAGE + '==' + status['latest'])
+    return True
+
+
+def get_url(base_url):
+    """Return the PyPi json url of this package."""
+    return '{}/{}/json'.format(base_url.rstrip('/'), PACKAGE)
+
+
+def get_cached(url):
+    """Return the cached version if it is still fresh."""
+    cached = CACHE.get(url)
+    if cached is None or time.monotonic() - cached['fetched'] > CACHE_TTL:
+        return None
+    return cached['version']
+
+
+def get_cache_headers(url):
+    """Return headers to revalidate the cached answer."""
+    cached = CACHE.get(url)
+    if cached is None or cached['etag'] is None:
+        return {}
+    return {'If-None-Match': cached['etag']}
+
+
+def store_response(url, response):
+    """Cache a PyPi response and return the version in it."""
+    if response.status_code == 304 and url in CACHE:
+        CACHE[url]['fetched'] = time.monotonic()
+        return CACHE[url]['version']
+    if response.status_code != 200:
+        return None
+    version = response.json()['info']['version']
+    CACHE[url] = {'version': version,
+                  'etag': response.headers.get('ETag'),
+                  'fetched': time.monotonic()}
     return version
+
+
+def format_version(version):
+    """Return version as a pip version specifier."""
+    return '' if not version else '==' + version
+
+
+def get_installed_version():
+    """Return the installed version of this package, or None."""
+    try:
+        from importlib import metadata
+        return metadata.version(PACKAGE)
+    except ImportError:
+        pass
+    except Exception:  # pylint: disable=W0703
+        return None
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution(PACKAGE).version
+    except Exception:  # pylint: disable=W0703
+        return None
+
+
+def is_newer(version, installed):
+    """Return True if version is newer than the installed version."""
+    if not installed:
+        return True
+    return version_key(version) > version_key(installed)
+
+
+def version_key(version):
+    """Return a comparable key for a version string.
+
+    PEP 440 ordering is used, so 1.4.0rc1 sorts before 1.4.0.
+    """
+    try:
+        from packaging.version import parse
+    except ImportError:
+        try:
+            from pkg_resources import parse_version as parse
+        except ImportError:
+            parse = None
+    if parse is not None:
+        try:
+            return (1, parse(version))
+        except Exception:  # pylint: disable=W0703
+            pass
+    # Without a version parser, a release sorts after its pre-releases.
+    release, suffix = re.match(r'v?([\d.]*)(.*)', version.strip()).groups()
+    numbers = tuple(int(part) for part in release.split('.') if part)
+    return (0, numbers, not suffix, suffix)
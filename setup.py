@@ -12,6 +12,9 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/ludeeus/pyupdate",
     packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': ['pyupdate = pyupdate.cli:main'],
+    },
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
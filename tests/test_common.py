@@ -0,0 +1,22 @@
+"""Tests for the helpers shared by all resource types."""
+from pyupdate.ha_custom import common
+
+
+def test_read_version(tmp_path):
+    """The version is read from the whole file by default."""
+    path = tmp_path / 'example.py'
+    path.write_text('"""Doc."""\n' * 100 + "__version__ = '1.2.3'\n")
+    assert common.read_version(str(path)) == '1.2.3'
+    assert common.read_version(str(path), 100) == ''
+    assert common.read_version(str(tmp_path / 'missing.py')) == ''
+
+
+def test_read_version_limit_keeps_complete_lines(tmp_path):
+    """Only a line cut off in the middle by the limit is dropped."""
+    path = tmp_path / 'example.py'
+    path.write_text('VERSION = "1"\nx = 1\n')
+    assert common.read_version(str(path), 14) == '1'
+    assert common.read_version(str(path), 13) == '1'
+    assert common.read_version(str(path), 12) == ''
+    path.write_text('VERSION = "1"  # comment\n')
+    assert common.read_version(str(path), 13) == ''
@@ -0,0 +1,51 @@
+"""Tests for the import footprint of pyupdate."""
+import json
+import subprocess
+import sys
+
+# Standard library modules Home Assistant has loaded long before pyupdate.
+STDLIB = ('argparse', 'asyncio', 'collections', 'concurrent.futures',
+          'functools', 'hashlib', 'json', 'logging', 'random', 're',
+          'shutil', 'subprocess', 'tempfile', 'threading', 'urllib.parse')
+MODULES = ('pyupdate.self', 'pyupdate.cli',
+           'pyupdate.ha_custom.custom_cards',
+           'pyupdate.ha_custom.custom_components',
+           'pyupdate.ha_custom.python_scripts',
+           'pyupdate.ha_custom.manager',
+           'pyupdate.ha_custom.poller',
+           'pyupdate.ha_custom.registry')
+BUDGET = 0.05
+
+SCRIPT = """
+import importlib, json, sys, time
+for name in {stdlib!r}:
+    importlib.import_module(name)
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed,
+                  'yaml': 'yaml' in sys.modules,
+                  'requests': 'requests' in sys.modules}}))
+"""
+
+
+def measure():
+    """Import all pyupdate modules in a fresh interpreter."""
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT.format(stdlib=STDLIB, modules=MODULES)])
+    return json.loads(output.decode('utf-8'))
+
+
+def test_no_heavy_imports():
+    """Importing pyupdate does not load yaml or requests."""
+    result = measure()
+    assert not result['yaml']
+    assert not result['requests']
+
+
+def test_import_time():
+    """Importing pyupdate stays within a few milliseconds."""
+    # Take the best of a few runs to keep the test stable on busy CI.
+    elapsed = min(measure()['elapsed'] for _ in range(3))
+    assert elapsed < BUDGET, elapsed
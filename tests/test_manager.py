@@ -0,0 +1,123 @@
+"""Tests for sharing remote data between views of the manager."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pyupdate.ha_custom import common
+
+MANIFEST = {'sensor.example': {'version': '1.0'}}
+
+
+@pytest.fixture
+def manager():
+    """Return a manager with a fresh cache."""
+    pytest.importorskip('requests')
+    from pyupdate.ha_custom.manager import Manager
+    return Manager()
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """Replace manifest fetching with a slow stub, return the fetch log."""
+    log = []
+
+    async def fetch_manifest(url, keys=None, executor=None, session=None):
+        """Return MANIFEST after a short delay."""
+        log.append(url)
+        await asyncio.sleep(0.2)
+        return MANIFEST
+
+    monkeypatch.setattr(common, 'fetch_manifest', fetch_manifest)
+    return log
+
+
+def run(coro):
+    """Run a coroutine in a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_concurrent_callers_share_one_fetch(manager, fetches):
+    """Callers asking for the same manifest at once cause one fetch."""
+    async def scenario():
+        """Ask for the same manifest three times at once."""
+        return await asyncio.gather(
+            *[manager.get_manifest('repos.json') for _ in range(3)])
+
+    assert run(scenario()) == [MANIFEST] * 3
+    assert fetches == ['repos.json']
+
+
+def test_cancelled_leader_hands_over(manager, fetches):
+    """A waiter takes over when the caller doing the fetch is cancelled."""
+    async def scenario():
+        """Cancel the first caller while the second one waits on it."""
+        leader = asyncio.ensure_future(manager.get_manifest('repos.json'))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.ensure_future(manager.get_manifest('repos.json'))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await waiter
+
+    assert run(scenario()) == MANIFEST
+    assert fetches == ['repos.json', 'repos.json']
+
+
+def test_timeout_in_one_loop_does_not_leak(manager, fetches):
+    """A timed out config dir does not fail another one sharing its fetch."""
+    results = {}
+
+    def check(name, delay, timeout):
+        """Fetch the manifest in a loop of its own, like the cli does."""
+        time.sleep(delay)
+        try:
+            results[name] = run(asyncio.wait_for(
+                manager.get_manifest('repos.json'), timeout))
+        except asyncio.TimeoutError:
+            results[name] = 'timeout'
+        except BaseException as error:  # pylint: disable=W0703
+            results[name] = error
+
+    threads = [threading.Thread(target=check, args=('first', 0, 0.1)),
+               threading.Thread(target=check, args=('second', 0.05, 5))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {'first': 'timeout', 'second': MANIFEST}
+
+
+class View():
+    """Stand-in for a view of one config dir."""
+
+
+def test_sequential_views_share_manifests(manager, fetches):
+    """Views created one after another reuse the released manifests."""
+    async def scenario():
+        """Check five config dirs one at a time, like cli -j 1."""
+        for _ in range(5):
+            view = View()
+            catalog = await manager.get_catalog(
+                view, 'component', ['repos.json'])
+            assert list(catalog) == list(MANIFEST)
+            manager.release(view)
+
+    run(scenario())
+    assert fetches == ['repos.json']
+
+
+def test_expired_unused_manifests_are_dropped(fetches):
+    """Manifests no view uses are dropped once they expire."""
+    pytest.importorskip('requests')
+    from pyupdate.ha_custom.manager import Manager
+    manager = Manager(ttl=0)
+    view = View()
+    run(manager.get_catalog(view, 'component', ['repos.json']))
+    assert manager.manifests and manager.catalogs
+    manager.release(view)
+    assert not manager.manifests and not manager.catalogs
@@ -0,0 +1,136 @@
+"""Tests for rate-limit aware scheduling of remote requests."""
+import asyncio
+import http.server
+import threading
+import time
+
+import pytest
+
+from pyupdate.ha_custom import common, ratelimit
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answer every request with the rate limit headers of the server."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Record the request and send the configured budget."""
+        self.server.requests.append(
+            (time.monotonic(), dict(self.headers.items())))
+        remaining = max(0, self.server.remaining - len(self.server.requests))
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('X-RateLimit-Limit', str(self.server.remaining))
+        self.send_header('X-RateLimit-Remaining', str(remaining))
+        self.send_header('X-RateLimit-Reset', str(self.server.reset))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        """Keep test output quiet."""
+
+
+@pytest.fixture
+def stub():
+    """Run a local server reporting a budget of 5 requests for 2 seconds."""
+    pytest.importorskip('requests')
+    server = http.server.HTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.remaining = 5
+    server.reset = time.time() + 2
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(coro):
+    """Run a coroutine in a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def budget(remaining, window, reserve=ratelimit.RESERVE):
+    """Return a RateLimit that has seen remaining requests for window s."""
+    limit = ratelimit.RateLimit('example.com', reserve)
+    limit.update({'X-RateLimit-Remaining': str(remaining),
+                  'X-RateLimit-Reset': str(time.time() + window)})
+    return limit
+
+
+def test_unknown_budget_is_not_limited():
+    """Hosts without rate limit headers are neither deferred nor spaced."""
+    limit = ratelimit.RateLimit('example.com')
+    assert limit.allow()
+    assert limit.take_slot() == 0
+    assert limit.take_slot() == 0
+
+
+def test_take_slot_spreads_budget():
+    """Consecutive slots are spaced over the remaining window."""
+    limit = budget(100, 100)
+    waits = [limit.take_slot() for _ in range(3)]
+    assert waits[0] == pytest.approx(0, abs=0.05)
+    assert waits[1] == pytest.approx(1, abs=0.05)
+    assert waits[2] == pytest.approx(2, abs=0.1)
+    assert limit.remaining == 97
+
+
+def test_take_slot_spacing_is_capped():
+    """A nearly spent budget never spaces requests more than MAX_SPACING."""
+    limit = budget(1, 3600)
+    limit.take_slot()
+    assert limit.take_slot() == pytest.approx(ratelimit.MAX_SPACING, abs=0.1)
+
+
+def test_allow_keeps_reserve_for_installed_items():
+    """Only requests for installed items may dip into the reserve."""
+    limit = budget(5, 60, reserve=10)
+    assert not limit.allow(ratelimit.PRIORITY_DEFAULT)
+    assert limit.allow(ratelimit.PRIORITY_INSTALLED)
+    limit = budget(0, 60, reserve=10)
+    assert not limit.allow(ratelimit.PRIORITY_INSTALLED)
+    limit = budget(0, -1, reserve=10)
+    assert limit.allow(ratelimit.PRIORITY_DEFAULT)
+
+
+def test_get_remote_follows_stub_headers(stub):
+    """The budget reported by the host defers and spaces later requests."""
+    url = 'http://127.0.0.1:{}/repos.json'.format(stub.server_port)
+
+    async def scenario():
+        """Spend the stub budget with both priorities."""
+        first = await common.get_remote(url)
+        deferred = await common.get_remote(url)
+        installed = await asyncio.gather(*[
+            common.get_remote(url, priority=ratelimit.PRIORITY_INSTALLED)
+            for _ in range(2)])
+        return first, deferred, installed
+
+    first, deferred, installed = run(scenario())
+    assert first.status_code == 200
+    # 4 left is below the reserve, default requests are deferred.
+    assert deferred is None
+    assert [response.status_code for response in installed] == [200, 200]
+    assert len(stub.requests) == 3
+    gaps = [later[0] - earlier[0] for earlier, later
+            in zip(stub.requests, stub.requests[1:])]
+    # About 2 s left for 4 requests, so at least ~0.5 s between them.
+    assert min(gaps) > 0.3
+
+
+def test_token_only_sent_to_github(stub, monkeypatch):
+    """The GitHub token is never sent to other hosts."""
+    monkeypatch.setattr(common, 'GITHUB_TOKEN', None)
+    common.set_github_token('secret')
+    url = 'http://127.0.0.1:{}/repos.json'.format(stub.server_port)
+    assert common.get_headers(
+        'https://raw.githubusercontent.com/a/b/master/repos.json')[
+            'Authorization'] == 'token secret'
+    assert 'Authorization' not in common.get_headers(url)
+    run(common.get_remote(url, priority=ratelimit.PRIORITY_INSTALLED))
+    assert 'Authorization' not in stub.requests[0][1]
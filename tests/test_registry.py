@@ -0,0 +1,162 @@
+"""Tests for the shared resource pipeline of all resource types."""
+import asyncio
+import json
+
+import pytest
+
+from pyupdate.ha_custom import common, registry
+from pyupdate.ha_custom.custom_cards import CustomCards
+from pyupdate.ha_custom.custom_components import CustomComponents
+
+COMPONENTS = {'sensor.example': {
+    'version': '2.0',
+    'local_location': '/custom_components/sensor/example.py',
+    'remote_location': 'https://example.com/sensor/example.py',
+    'resources': ['https://example.com/sensor/example_helper.py'],
+    'visit_repo': 'https://example.com', 'changelog': ''}}
+CARDS = {'example-card': {
+    'version': '2.0',
+    'remote_location': 'https://example.com/example-card.js',
+    'visit_repo': 'https://example.com', 'changelog': ''}}
+FILES = {
+    'https://example.com/sensor/example.py':
+        b"VERSION = '2.0'\nREQUIREMENTS = ['example==2.0']\n",
+    'https://example.com/sensor/example_helper.py': b"HELPER = True\n",
+    'https://example.com/example-card.js': b"// 2.0\n",
+    'https://example.com/example-card-editor.js': b"// editor\n"}
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """Serve the manifests and FILES, return the pip installs made."""
+    installs = []
+
+    async def fetch_manifest(url, keys=None, executor=None, session=None):
+        """Return the manifest for the resource type in url."""
+        if 'custom-components' in url:
+            return COMPONENTS
+        if 'custom-cards' in url:
+            return CARDS
+        return {}
+
+    async def fetch_file(remote_file, session=None):
+        """Return a file from FILES, None if it does not exist."""
+        return FILES.get(remote_file)
+
+    async def update_many(packages):
+        """Record pip installs instead of running pip."""
+        if packages:
+            installs.append(list(packages))
+
+    monkeypatch.setattr(common, 'fetch_manifest', fetch_manifest)
+    monkeypatch.setattr(common, 'fetch_file', fetch_file)
+    monkeypatch.setattr(common, 'update_many', update_many)
+    return installs
+
+
+def run(coro):
+    """Run a coroutine in a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_component_update_installs_resources_and_requirements(
+        tmp_path, remote):
+    """Updating a component writes its extra resources and requirements."""
+    directory = tmp_path / 'custom_components' / 'sensor'
+    directory.mkdir(parents=True)
+    (directory / 'example.py').write_text("VERSION = '1.0'\n")
+    components = CustomComponents(str(tmp_path), [])
+
+    data, count = run(components.get_sensor_data())
+    assert count == 1 and data['has_update'] == ['sensor.example']
+    run(components.update_all())
+    assert (directory / 'example.py').read_bytes() == FILES[
+        'https://example.com/sensor/example.py']
+    assert (directory / 'example_helper.py').exists()
+    assert remote == [['example==2.0']]
+
+
+def test_component_requirements_only_for_written_files(tmp_path, remote):
+    """A component whose file could not be written installs nothing."""
+    directory = tmp_path / 'custom_components' / 'sensor'
+    directory.mkdir(parents=True)
+    (directory / 'example.py').write_text("VERSION = '1.0'\n")
+    components = CustomComponents(str(tmp_path), [])
+
+    plan = run(components.plan())
+    assert plan['requirements'] == ['example==2.0']
+    plan['downloads'][0]['local'] = str(tmp_path / 'missing' / 'example.py')
+    run(components.execute(plan))
+    assert remote == []
+
+
+def test_card_pipeline(tmp_path, remote):
+    """Cards used in lovelace are found, updated and their version kept."""
+    (tmp_path / '.storage').mkdir()
+    (tmp_path / '.storage' / 'lovelace').write_text(json.dumps(
+        {'data': {'config': {'resources': [
+            {'url': '/local/example-card.js', 'type': 'module'}]}}}))
+    (tmp_path / 'www').mkdir()
+    (tmp_path / 'www' / 'example-card.js').write_text('// 1.0\n')
+    cards = CustomCards(str(tmp_path), 'storage', [], [])
+
+    data, count = run(cards.get_sensor_data())
+    assert count == 1 and data['has_update'] == ['example-card']
+    run(cards.update_all())
+    assert (tmp_path / 'www' / 'example-card.js').read_text() == '// 2.0\n'
+    assert (tmp_path / 'www' / 'example-card-editor.js').exists()
+    assert not (tmp_path / 'www' / 'example-card.lib.js').exists()
+    data, count = run(cards.get_sensor_data())
+    assert count == 0 and data['example-card']['local'] == '2.0'
+
+
+def test_manager_resources_uses_the_type_handler(tmp_path, remote):
+    """Manager.resources hands out the handler of built-in types."""
+    pytest.importorskip('requests')
+    from pyupdate.ha_custom.manager import Manager
+    manager = Manager()
+    view = manager.resources('card', str(tmp_path), mode='storage')
+    assert isinstance(view, CustomCards)
+    assert isinstance(
+        manager.resources('component', str(tmp_path)), CustomComponents)
+
+
+def test_generic_cards_are_rejected(tmp_path, remote):
+    """A generic card view fails loudly instead of finding no cards."""
+    with pytest.raises(NotImplementedError):
+        run(registry.Resources('card', str(tmp_path)).get_sensor_data())
+
+
+def test_versionless_scripts_are_read_once(tmp_path, monkeypatch):
+    """Scripts without a version are cached by the scan, not re-read."""
+    (tmp_path / 'python_scripts').mkdir()
+    (tmp_path / 'python_scripts' / 'example.py').write_text('x = 1\n')
+
+    async def fetch_manifest(url, keys=None, executor=None, session=None):
+        """Track the script in a custom repo."""
+        return {'example': {
+            'version': '1.0',
+            'local_location': '/python_scripts/example.py',
+            'remote_location': 'https://example.com/example.py',
+            'visit_repo': '', 'changelog': ''}}
+
+    reads = []
+    read_version = common.read_version
+
+    def counting_read_version(path, limit=None):
+        """Count the reads of a script."""
+        reads.append(limit)
+        return read_version(path, limit)
+
+    monkeypatch.setattr(common, 'fetch_manifest', fetch_manifest)
+    monkeypatch.setattr(common, 'read_version', counting_read_version)
+    scripts = registry.Resources(
+        'python_script', str(tmp_path), ['https://example.com/repos.json'])
+    for _ in range(3):
+        data, count = run(scripts.get_sensor_data())
+        assert count == 0 and 'example' not in data
+    assert reads == [registry.HEADER_SIZE]